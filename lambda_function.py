@@ -2,13 +2,16 @@ import json
 import boto3
 import re
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from boto3.dynamodb.conditions import Key, Attr
 import traceback
 import concurrent.futures
+import heapq
+import bisect
 
 # Initialize AWS clients and resources.
 sqs = boto3.client('sqs')
+s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
 lambda_client = boto3.client('lambda')
 
@@ -31,6 +34,13 @@ FCM_LAMBDA_FUNCTION_NAME = 'FCM-Generic-Code'
 # Configuration for cooldown period in minutes
 NOTIFICATION_COOLDOWN_PERIOD = 900  # default is 15 minutes
 
+# How far (in seconds) a reading may trail the newest reading seen during a replay
+# before it is treated as late and skipped
+REPLAY_ALLOWED_LATENESS = 300  # default is 5 minutes
+
+# Readings without a UTC offset may be stamped in any local time, up to UTC+14
+REPLAY_MAX_UTC_OFFSET = timedelta(hours=14)
+
 def json_default(obj):
     if isinstance(obj, Decimal):
         return str(obj)
@@ -271,6 +281,124 @@ def is_within_cooldown(device_id, timestamp):
         print('Error checking cooldown:', e)
         return False
 
+def get_device_context(device_id):
+    """Return (patient_id, location, patient_name) for the given device_id."""
+    # Retrieve patient_id from patient-device-location table using device_id as partition key
+    device_response = device_location_table.query(
+        KeyConditionExpression=Key('device_id').eq(device_id)
+    )
+    print("Device response:", json.dumps(device_response, default=json_default))  # Debug print
+    if not device_response['Items']:
+        raise ValueError("No patient found for the given device_id")
+    patient_id = device_response['Items'][0]['patient_id']
+    location = device_response['Items'][0]['location']
+    print("Patient ID:", patient_id)  # Debug print
+
+    # Retrieve patient_name from patients table using patient_id as partition key
+    patient_response = patients_table.get_item(
+        Key={'patient_id': patient_id}
+    )
+    print("Patient response:", json.dumps(patient_response, default=json_default))  # Debug print
+    if 'Item' not in patient_response:
+        raise ValueError("No patient found for the given patient_id")
+    patient_name = patient_response['Item']['patient_name']
+    print("Patient Name:", patient_name)  # Debug print
+
+    return patient_id, location, patient_name
+
+def get_threshold_data(patient_id):
+    """Resolve thresholds for a patient: patient, then facility, then global."""
+    # Retrieve patient table using patient_id as partition key
+    threshold_response = threshold_table.get_item(
+        Key={'patient_id': patient_id}
+    )
+    print("Threshold response:", json.dumps(threshold_response, default=json_default))  # Debug print
+
+    if 'Item' in threshold_response:
+        threshold_data = threshold_response['Item']
+    else:
+        # If no patient-specific threshold is found, try to get facility-specific threshold
+        facility_response = patient_facility_table.get_item(
+            Key={'patient_id': patient_id}
+        )
+        print("Facility response:", json.dumps(facility_response, default=json_default))  # Debug print
+
+        if 'Item' in facility_response:
+            facility_id = facility_response['Item']['facility_id']
+            facility_threshold_response = facility_threshold_table.get_item(
+                Key={'facility_id': facility_id}
+            )
+            print("Facility Threshold response:", json.dumps(facility_threshold_response, default=json_default))  # Debug print
+
+            if 'Item' in facility_threshold_response:
+                threshold_data = facility_threshold_response['Item']
+            else:
+                # If no facility-specific threshold is found, use the global threshold
+                global_threshold_response = global_threshold_table.get_item(
+                    Key={'threshold_id': '1'}
+                )
+                print("Global Threshold response:", json.dumps(global_threshold_response, default=json_default))  # Debug print
+
+                if 'Item' in global_threshold_response:
+                    threshold_data = global_threshold_response['Item']
+                else:
+                    raise ValueError("No threshold data found for the given patient_id, facility_id, or global threshold")
+        else:
+            # If no facility data is found, use the global threshold
+            global_threshold_response = global_threshold_table.get_item(
+                Key={'threshold_id': '1'}
+            )
+            print("Global Threshold response:", json.dumps(global_threshold_response, default=json_default))  # Debug print
+
+            if 'Item' in global_threshold_response:
+                threshold_data = global_threshold_response['Item']
+            else:
+                raise ValueError("No threshold data found for the given patient_id, facility_id, or global threshold")
+
+    return threshold_data
+
+def build_notifications(message_body, threshold_data, location, timestamp):
+    """Evaluate a sensor reading against thresholds and return the notifications it raises."""
+    # Extract relevant sensor data from message
+    light_value = float(message_body.get('light'))
+    sound_value = float(message_body.get('sound'))
+    temp_value = float(message_body.get('temp'))
+
+    # Extract relevant threshold values
+    ambient_light_min = float(threshold_data.get('ambient_light_min'))
+    ambient_light_max = float(threshold_data.get('ambient_light_max'))
+    ambient_sound_min = float(threshold_data.get('ambient_sound_min'))
+    ambient_sound_max = float(threshold_data.get('ambient_sound_max'))
+    ambient_temperature_min = float(threshold_data.get('ambient_temperature_min'))
+    ambient_temperature_max = float(threshold_data.get('ambient_temperature_max'))
+
+    timestamp_dt = datetime.fromisoformat(timestamp)
+
+    formatted_timestamp = timestamp_dt.strftime("%-d-%b-%Y %H:%M")
+
+    # List to hold notifications
+    notifications = []
+
+    # Check if light value is within or outside threshold range
+    if light_value < ambient_light_min:
+        notifications.append({'message': f'Light value ({light_value:.2f} lux) is below ambient light minimum value ({ambient_light_min:.2f} lux) in {location} at {formatted_timestamp}', 'category': 'ambient_light'})
+    elif light_value > ambient_light_max:
+        notifications.append({'message': f'Light value ({light_value:.2f} lux) is above ambient light maximum value ({ambient_light_max:.2f} lux) in {location} at {formatted_timestamp}', 'category': 'ambient_light'})
+
+    # Check if sound value is within or outside threshold range
+    if sound_value < ambient_sound_min:
+        notifications.append({'message': f'Sound value ({sound_value:.2f} dB) is below ambient sound minimum value ({ambient_sound_min:.2f} dB) in {location} at {formatted_timestamp}', 'category': 'ambient_sound'})
+    elif sound_value > ambient_sound_max:
+        notifications.append({'message': f'Sound value ({sound_value:.2f} dB) is above ambient sound maximum value ({ambient_sound_max:.2f} dB) in {location} at {formatted_timestamp}', 'category': 'ambient_sound'})
+
+    # Check if temperature value is within or outside threshold range
+    if temp_value < ambient_temperature_min:
+        notifications.append({'message': f'Temperature value ({temp_value:.2f} deg) is below ambient temperature minimum value ({ambient_temperature_min:.2f} deg) in {location} at {formatted_timestamp}', 'category': 'ambient_temperature'})
+    elif temp_value > ambient_temperature_max:
+        notifications.append({'message': f'Temperature value ({temp_value:.2f} deg) is above ambient temperature maximum value ({ambient_temperature_max:.2f} deg) in {location} at {formatted_timestamp}', 'category': 'ambient_temperature'})
+
+    return notifications
+
 def handle_sqs_event(event):
     for record in event['Records']:
         try:
@@ -286,120 +414,12 @@ def handle_sqs_event(event):
             timestamp = message_body.get('timestamp')
             print("Timestamp:", timestamp)  # Debug print
 
-            # Retrieve patient_id from patient-device-location table using device_id as partition key
-            device_response = device_location_table.query(
-                KeyConditionExpression=Key('device_id').eq(device_id)
-            )
-            print("Device response:", json.dumps(device_response, default=json_default))  # Debug print
-            if not device_response['Items']:
-                raise ValueError("No patient found for the given device_id")
-            patient_id = device_response['Items'][0]['patient_id']
-            location = device_response['Items'][0]['location']
-            print("Patient ID:", patient_id)  # Debug print
-
-            # Retrieve patient_name from patients table using patient_id as partition key
-            patient_response = patients_table.get_item(
-                Key={'patient_id': patient_id}
-            )
-            print("Patient response:", json.dumps(patient_response, default=json_default))  # Debug print
-            if 'Item' not in patient_response:
-                raise ValueError("No patient found for the given patient_id")
-            patient_name = patient_response['Item']['patient_name']
-            print("Patient Name:", patient_name)  # Debug print
-
-            # Retrieve patient table using patient_id as partition key
-            threshold_response = threshold_table.get_item(
-                Key={'patient_id': patient_id}
-            )
-            print("Threshold response:", json.dumps(threshold_response, default=json_default))  # Debug print
+            patient_id, location, patient_name = get_device_context(device_id)
 
-            if 'Item' in threshold_response:
-                threshold_data = threshold_response['Item']
-            else:
-                # If no patient-specific threshold is found, try to get facility-specific threshold
-                facility_response = patient_facility_table.get_item(
-                    Key={'patient_id': patient_id}
-                )
-                print("Facility response:", json.dumps(facility_response, default=json_default))  # Debug print
-
-                if 'Item' in facility_response:
-                    facility_id = facility_response['Item']['facility_id']
-                    facility_threshold_response = facility_threshold_table.get_item(
-                        Key={'facility_id': facility_id}
-                    )
-                    print("Facility Threshold response:", json.dumps(facility_threshold_response, default=json_default))  # Debug print
-
-                    if 'Item' in facility_threshold_response:
-                        threshold_data = facility_threshold_response['Item']
-                    else:
-                        # If no facility-specific threshold is found, use the global threshold
-                        global_threshold_response = global_threshold_table.get_item(
-                            Key={'threshold_id': '1'}
-                        )
-                        print("Global Threshold response:", json.dumps(global_threshold_response, default=json_default))  # Debug print
-
-                        if 'Item' in global_threshold_response:
-                            threshold_data = global_threshold_response['Item']
-                        else:
-                            raise ValueError("No threshold data found for the given patient_id, facility_id, or global threshold")
-                else:
-                    # If no facility data is found, use the global threshold
-                    global_threshold_response = global_threshold_table.get_item(
-                        Key={'threshold_id': '1'}
-                    )
-                    print("Global Threshold response:", json.dumps(global_threshold_response, default=json_default))  # Debug print
-
-                    if 'Item' in global_threshold_response:
-                        threshold_data = global_threshold_response['Item']
-                    else:
-                        raise ValueError("No threshold data found for the given patient_id, facility_id, or global threshold")
-
-            # Extract relevant sensor data from message
-            light_value = float(message_body.get('light'))
-            sound_value = float(message_body.get('sound'))
-            temp_value = float(message_body.get('temp'))
-            print("Light value:", light_value)  # Debug print
-            print("Sound value:", sound_value)  # Debug print
-            print("Temperature value:", temp_value)  # Debug print
-
-            # Extract relevant threshold values
-            ambient_light_min = float(threshold_data.get('ambient_light_min'))
-            ambient_light_max = float(threshold_data.get('ambient_light_max'))
-            ambient_sound_min = float(threshold_data.get('ambient_sound_min'))
-            ambient_sound_max = float(threshold_data.get('ambient_sound_max'))
-            ambient_temperature_min = float(threshold_data.get('ambient_temperature_min'))
-            ambient_temperature_max = float(threshold_data.get('ambient_temperature_max'))
-            print("Ambient light min:", ambient_light_min)  # Debug print
-            print("Ambient light max:", ambient_light_max)  # Debug print
-            print("Ambient sound min:", ambient_sound_min)  # Debug print
-            print("Ambient sound max:", ambient_sound_max)  # Debug print
-            print("Ambient temperature min:", ambient_temperature_min)  # Debug print
-            print("Ambient temperature max:", ambient_temperature_max)  # Debug print
-
-            timestamp_dt = datetime.fromisoformat(timestamp)
-
-            formatted_timestamp = timestamp_dt.strftime("%-d-%b-%Y %H:%M")
-
-            # List to hold notifications
-            notifications = []
-
-            # Check if light value is within or outside threshold range
-            if light_value < ambient_light_min:
-                notifications.append({'message': f'Light value ({light_value:.2f} lux) is below ambient light minimum value ({ambient_light_min:.2f} lux) in {location} at {formatted_timestamp}', 'category': 'ambient_light'})
-            elif light_value > ambient_light_max:
-                notifications.append({'message': f'Light value ({light_value:.2f} lux) is above ambient light maximum value ({ambient_light_max:.2f} lux) in {location} at {formatted_timestamp}', 'category': 'ambient_light'})
-
-            # Check if sound value is within or outside threshold range
-            if sound_value < ambient_sound_min:
-                notifications.append({'message': f'Sound value ({sound_value:.2f} dB) is below ambient sound minimum value ({ambient_sound_min:.2f} dB) in {location} at {formatted_timestamp}', 'category': 'ambient_sound'})
-            elif sound_value > ambient_sound_max:
-                notifications.append({'message': f'Sound value ({sound_value:.2f} dB) is above ambient sound maximum value ({ambient_sound_max:.2f} dB) in {location} at {formatted_timestamp}', 'category': 'ambient_sound'})
-
-            # Check if temperature value is within or outside threshold range
-            if temp_value < ambient_temperature_min:
-                notifications.append({'message': f'Temperature value ({temp_value:.2f} deg) is below ambient temperature minimum value ({ambient_temperature_min:.2f} deg) in {location} at {formatted_timestamp}', 'category': 'ambient_temperature'})
-            elif temp_value > ambient_temperature_max:
-                notifications.append({'message': f'Temperature value ({temp_value:.2f} deg) is above ambient temperature maximum value ({ambient_temperature_max:.2f} deg) in {location} at {formatted_timestamp}', 'category': 'ambient_temperature'})
+            threshold_data = get_threshold_data(patient_id)
+
+            notifications = build_notifications(message_body, threshold_data, location, timestamp)
+            print("Notifications:", notifications)  # Debug print
 
             if not notifications:
                 # No notifications to insert, continue to next record
@@ -459,6 +479,267 @@ def handle_sqs_event(event):
             print("Stack trace:", traceback.format_exc())
             raise RuntimeError('Error processing SQS event')
 
+def parse_replay_timestamp(timestamp):
+    """Parse an ISO timestamp for replay ordering, treating values without an offset as UTC."""
+    timestamp_dt = datetime.fromisoformat(timestamp)
+    if timestamp_dt.tzinfo is None:
+        timestamp_dt = timestamp_dt.replace(tzinfo=timezone.utc)
+    return timestamp_dt
+
+def get_stored_notification_timestamps(device_id, timestamp):
+    """Return the sorted timestamps of every stored notification for device_id from one cooldown period before `timestamp` onwards."""
+    since = datetime.fromisoformat(timestamp) - timedelta(seconds=NOTIFICATION_COOLDOWN_PERIOD)
+    stored = set()
+    last_evaluated_key = None
+
+    while True:
+        query_params = {
+            "IndexName": 'device_id-timestamp-index',
+            "KeyConditionExpression": Key('device_id').eq(device_id) & Key('timestamp').gte(since.isoformat()),
+            "ScanIndexForward": True
+        }
+
+        if last_evaluated_key is not None:
+            query_params["ExclusiveStartKey"] = last_evaluated_key
+
+        response = smart_notification_table.query(**query_params)
+        stored.update(parse_replay_timestamp(item['timestamp']) for item in response['Items'])
+
+        if 'LastEvaluatedKey' not in response:
+            break
+
+        last_evaluated_key = response['LastEvaluatedKey']
+
+    return sorted(stored)
+
+def replay_reading(message_body, timestamp_dt, devices, batch, pushes, stats):
+    """Process one released reading of a replay using the in-memory per-device state."""
+    device_id = message_body.get('device_id')
+    timestamp = message_body.get('timestamp')
+
+    if device_id not in devices:
+        try:
+            patient_id, location, patient_name = get_device_context(device_id)
+            threshold_data = get_threshold_data(patient_id)
+        except ValueError as e:
+            # Missing device, patient or threshold data won't appear mid-replay, so skip the device from now on
+            print(f'Error loading state for device {device_id}:', e)
+            devices[device_id] = None
+        else:
+            devices[device_id] = {
+                'patient_id': patient_id,
+                'location': location,
+                'patient_name': patient_name,
+                'threshold_data': threshold_data,
+                # Notifications already stored in the replay window drive the cooldown and mark readings as written
+                'stored_notifications': get_stored_notification_timestamps(device_id, timestamp),
+                'last_notification': None
+            }
+
+    state = devices[device_id]
+    if state is None:
+        stats['errors'] += 1
+        return
+
+    try:
+        notifications = build_notifications(message_body, state['threshold_data'], state['location'], timestamp)
+    except Exception as e:
+        print(f'Error evaluating reading for device {device_id} at {timestamp}:', e)
+        stats['errors'] += 1
+        return
+
+    if not notifications:
+        return
+
+    stored_notifications = state['stored_notifications']
+    index = bisect.bisect_left(stored_notifications, timestamp_dt)
+    if timestamp_dt == state['last_notification'] or (index < len(stored_notifications) and stored_notifications[index] == timestamp_dt):
+        # Written by the live path, an earlier replay, or a duplicate reading in this stream
+        state['last_notification'] = timestamp_dt
+        stats['already_written'] += 1
+        return
+
+    # Cooldown only looks at notifications strictly earlier than this reading, same as is_within_cooldown
+    previous = [state['last_notification']] if state['last_notification'] is not None else []
+    if index:
+        previous.append(stored_notifications[index - 1])
+    if previous and (timestamp_dt - max(previous)).total_seconds() < NOTIFICATION_COOLDOWN_PERIOD:
+        stats['cooldown_skipped'] += len(notifications)
+        return
+
+    for notification in notifications:
+        # Derive the ID from the reading itself so a replay interrupted mid-batch can be re-run safely
+        notification_id = re.sub(r'[^a-zA-Z0-9]', '', f"{device_id}_{timestamp}_{notification['category']}")
+        batch.put_item(
+            Item={
+                'notification_id': notification_id,
+                'device_id': device_id,
+                'message': notification['message'],
+                'category': notification['category'],
+                'timestamp': timestamp,
+                'resolved': str(False),  # Set the default value to False as a string
+                'resolved_comments': '',
+                'patient': state['patient_name'],
+                'patient_id': state['patient_id']
+            }
+        )
+        stats['notifications'] += 1
+
+    state['last_notification'] = timestamp_dt
+
+    if pushes is None:
+        return
+
+    if 'supervisor_id' not in state:
+        try:
+            state['supervisor_id'] = get_supervisor_id(state['patient_id'])
+        except ValueError as e:
+            # No supervisor is assigned, so none of this device's readings can be pushed
+            print(f'Error getting supervisor for device {device_id}:', e)
+            state['supervisor_id'] = None
+        except Exception as e:
+            # Leave the supervisor unresolved so the next reading retries the lookup
+            print(f'Error getting supervisor for device {device_id}:', e)
+            stats['errors'] += 1
+            return
+
+    if state['supervisor_id'] is None:
+        # The rows are written, only the pushes for this reading are lost
+        stats['errors'] += 1
+        return
+
+    for notification in notifications:
+        pushes.append({
+            'notification_type': "alert",
+            'message_text': notification['message'],
+            'patient_id': state['patient_id'],
+            'supervisor_id': state['supervisor_id'],
+            'additional_data': {"timestamp": timestamp, "device_id": device_id}
+        })
+
+def release_device_readings(buffer, watermark, devices, batch, pushes, stats):
+    """Process the buffered readings of one device that are at or behind `watermark`, oldest first."""
+    pending = buffer['pending']
+    while pending and (watermark is None or pending[0][0] <= watermark):
+        released_dt, _, released_body = heapq.heappop(pending)
+        replay_reading(released_body, released_dt, devices, batch, pushes, stats)
+
+def replay_readings(lines, allowed_lateness=REPLAY_ALLOWED_LATENESS, send_fcm=False):
+    """
+    Reprocess a stream of sensor readings (one JSON object per line) in a single pass.
+
+    The stream must be time-ordered per device, but devices may be interleaved or grouped.
+    Each device keeps its own watermark (its newest timestamp minus allowed_lateness);
+    readings are held back until their device's watermark passes them and are then released
+    in timestamp order, so small out-of-order gaps do not affect cooldown decisions.
+    Readings behind their device's watermark are logged and counted as late. Readings dated
+    after the current time plus allowed_lateness are logged and rejected as future; readings
+    without an offset may be in any local time, so they get an extra REPLAY_MAX_UTC_OFFSET
+    of slack. For ordering, timestamps without an offset are compared as if they were UTC.
+
+    Device, patient and threshold lookups happen once per device, cooldown is tracked in
+    memory, and notifications are written through a DynamoDB batch writer. Each device's
+    stored notifications from one cooldown period before its first reading onwards are
+    loaded once: they count towards the cooldown, and a reading that already has a stored
+    notification at its timestamp is counted as already written instead of inserted again.
+
+    FCM notifications are only sent when send_fcm is set, and only after the batch writer
+    has flushed every row, so no push goes out for a row that failed to write.
+
+    :param lines: Iterable of NDJSON lines (str or bytes), each shaped like an SQS message body
+    :param allowed_lateness: Seconds a reading may trail its device's newest reading before it is skipped
+    :param send_fcm: Whether to invoke the FCM Lambda for replayed notifications
+    :return: Dictionary of replay counters
+    """
+    if allowed_lateness < 0:
+        raise ValueError("allowed_lateness must not be negative")
+
+    lateness = timedelta(seconds=allowed_lateness)
+    horizon = datetime.now(timezone.utc) + lateness
+    stats = {
+        'readings': 0, 'late': 0, 'future': 0, 'errors': 0,
+        'notifications': 0, 'cooldown_skipped': 0, 'already_written': 0
+    }
+    devices = {}
+    buffers = {}
+    pushes = [] if send_fcm else None
+    sequence = 0
+
+    with smart_notification_table.batch_writer(overwrite_by_pkeys=['notification_id', 'device_id']) as batch:
+        for line in lines:
+            if not line.strip():
+                continue
+            stats['readings'] += 1
+
+            try:
+                message_body = json.loads(line, parse_float=Decimal)
+                device_id = message_body.get('device_id')
+                if not isinstance(device_id, str):
+                    raise ValueError(f"device_id must be a string, got {device_id!r}")
+                timestamp = message_body['timestamp']
+                timestamp_dt = parse_replay_timestamp(timestamp)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                print('Skipping malformed reading:', e)
+                stats['errors'] += 1
+                continue
+
+            reading_horizon = horizon
+            if datetime.fromisoformat(timestamp).tzinfo is None:
+                reading_horizon += REPLAY_MAX_UTC_OFFSET
+            if timestamp_dt > reading_horizon:
+                # A reading from a bad clock must not drag the watermark forward
+                print(f'Skipping future reading for device {device_id} at {timestamp}')
+                stats['future'] += 1
+                continue
+
+            buffer = buffers.setdefault(device_id, {'newest': timestamp_dt, 'pending': []})
+            if timestamp_dt < buffer['newest'] - lateness:
+                print(f'Skipping late reading for device {device_id} at {timestamp}')
+                stats['late'] += 1
+                continue
+
+            if timestamp_dt > buffer['newest']:
+                buffer['newest'] = timestamp_dt
+
+            # The sequence number keeps readings with equal timestamps in arrival order
+            heapq.heappush(buffer['pending'], (timestamp_dt, sequence, message_body))
+            sequence += 1
+
+            release_device_readings(buffer, buffer['newest'] - lateness, devices, batch, pushes, stats)
+
+        # End of stream: everything still buffered is complete
+        for buffer in buffers.values():
+            release_device_readings(buffer, None, devices, batch, pushes, stats)
+
+    for push in pushes or []:
+        try:
+            invoke_fcm_lambda(**push)
+        except Exception as e:
+            print(f"Error sending FCM notification for device {push['additional_data']['device_id']}:", e)
+            stats['errors'] += 1
+
+    print("Replay finished:", stats)
+    return stats
+
+def handle_replay_event(event):
+    replay = event['replay']
+
+    send_fcm = replay.get('send_fcm', False)
+    if not isinstance(send_fcm, bool):
+        raise ValueError("send_fcm must be a boolean")
+
+    allowed_lateness = replay.get('allowed_lateness', REPLAY_ALLOWED_LATENESS)
+    if isinstance(allowed_lateness, bool) or not isinstance(allowed_lateness, int) or allowed_lateness < 0:
+        raise ValueError("allowed_lateness must be a non-negative integer number of seconds")
+
+    s3_object = s3.get_object(Bucket=replay['bucket'], Key=replay['key'])
+
+    return replay_readings(
+        s3_object['Body'].iter_lines(),
+        allowed_lateness=allowed_lateness,
+        send_fcm=send_fcm
+    )
+
 def lambda_handler(event, context):
     try:
         if 'httpMethod' in event:
@@ -509,6 +790,13 @@ def lambda_handler(event, context):
                 'statusCode': 200,
                 'body': json.dumps('Notifications processed successfully')
             }
+        elif 'replay' in event:
+            # Handle backfill/replay of an NDJSON backlog stored in S3
+            stats = handle_replay_event(event)
+            return {
+                'statusCode': 200,
+                'body': json.dumps(stats)
+            }
         else:
             return {
                 'statusCode': 400,
@@ -534,4 +822,11 @@ def lambda_handler(event, context):
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+# Example usage (for replaying a local NDJSON backlog)
+if __name__ == "__main__":
+    import sys
+
+    with open(sys.argv[1]) as backlog:
+        print(json.dumps(replay_readings(backlog)))
@@ -0,0 +1,312 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import lambda_function
+
+THRESHOLDS = {
+    'ambient_light_min': 0, 'ambient_light_max': 10,
+    'ambient_sound_min': 0, 'ambient_sound_max': 10,
+    'ambient_temperature_min': 0, 'ambient_temperature_max': 10
+}
+
+class FakeBatchWriter:
+    """Buffers puts like boto3's batch writer, dropping buffered items that share the overwrite keys."""
+
+    def __init__(self, table, overwrite_by_pkeys):
+        self.table = table
+        self.overwrite_by_pkeys = overwrite_by_pkeys
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for item in self.buffer:
+            self.table.put_item(Item=item)
+        return False
+
+    def put_item(self, Item):
+        if self.overwrite_by_pkeys:
+            keys = [Item[key] for key in self.overwrite_by_pkeys]
+            self.buffer = [item for item in self.buffer if [item[key] for key in self.overwrite_by_pkeys] != keys]
+        self.buffer.append(Item)
+
+class FakeNotificationTable:
+    """Stands in for the smart notification table, answering device/timestamp range queries in pages."""
+
+    page_size = 2
+
+    def __init__(self):
+        self.rows = {}
+        self.written = []
+        self.queries = 0
+
+    def store(self, device_id, timestamp):
+        self.rows[(f'stored{timestamp}', device_id)] = {'notification_id': f'stored{timestamp}', 'device_id': device_id, 'timestamp': timestamp}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self, overwrite_by_pkeys)
+
+    def put_item(self, Item):
+        self.rows[(Item['notification_id'], Item['device_id'])] = Item
+        self.written.append(Item)
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey=0, **kwargs):
+        self.queries += 1
+        device_condition, timestamp_condition = KeyConditionExpression.get_expression()['values']
+        device_id = device_condition.get_expression()['values'][1]
+        assert timestamp_condition.get_expression()['operator'] == '>='
+        since = timestamp_condition.get_expression()['values'][1]
+
+        items = sorted(
+            (item for item in self.rows.values() if item['device_id'] == device_id and item['timestamp'] >= since),
+            key=lambda item: item['timestamp']
+        )
+        end = ExclusiveStartKey + self.page_size
+        response = {'Items': items[ExclusiveStartKey:end]}
+        if end < len(items):
+            response['LastEvaluatedKey'] = end
+        return response
+
+class FakeBody:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def iter_lines(self):
+        return (line.encode() for line in self.lines)
+
+class FakeS3:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def get_object(self, Bucket, Key):
+        return {'Body': FakeBody(self.lines)}
+
+@pytest.fixture
+def table(monkeypatch):
+    fake = FakeNotificationTable()
+    monkeypatch.setattr(lambda_function, 'smart_notification_table', fake)
+    monkeypatch.setattr(lambda_function, 'get_device_context', lambda device_id: ('p1', 'Room 1', 'Pat'))
+    monkeypatch.setattr(lambda_function, 'get_threshold_data', lambda patient_id: THRESHOLDS)
+    return fake
+
+def reading(timestamp, light=50, device_id='d1'):
+    return json.dumps({'device_id': device_id, 'timestamp': timestamp, 'light': light, 'sound': 5, 'temp': 5})
+
+def written_timestamps(table):
+    return [item['timestamp'] for item in table.written]
+
+def test_out_of_order_readings_are_released_in_timestamp_order(table):
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2024-01-01T10:40:00'),
+        reading('2024-01-01T10:20:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=1800)
+
+    assert written_timestamps(table) == ['2024-01-01T10:00:00', '2024-01-01T10:20:00', '2024-01-01T10:40:00']
+    assert stats['late'] == 0
+
+def test_readings_behind_the_watermark_are_counted_as_late(table):
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2024-01-01T11:00:00'),
+        reading('2024-01-01T10:30:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=300)
+
+    assert written_timestamps(table) == ['2024-01-01T10:00:00', '2024-01-01T11:00:00']
+    assert stats['late'] == 1
+
+def test_watermark_is_kept_per_device(table):
+    lines = [
+        reading('2024-01-01T12:00:00', device_id='d1'),
+        reading('2024-01-01T10:00:00', device_id='d2'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=300)
+
+    assert stats['late'] == 0
+    assert stats['notifications'] == 2
+
+def test_future_readings_do_not_advance_the_watermark(table):
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2099-01-01T10:00:00'),
+        reading('2099-01-01T10:00:00+00:00'),
+        reading('2024-01-01T10:30:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=300)
+
+    assert written_timestamps(table) == ['2024-01-01T10:00:00', '2024-01-01T10:30:00']
+    assert stats['future'] == 2
+    assert stats['late'] == 0
+
+def test_naive_local_time_reading_near_now_is_processed(table):
+    # A device stamping local time at UTC+13 is 13 hours ahead of UTC now
+    local_now = (datetime.now(timezone.utc) + timedelta(hours=13)).replace(tzinfo=None)
+
+    stats = lambda_function.replay_readings([reading(local_now.isoformat())], allowed_lateness=0)
+
+    assert stats['future'] == 0
+    assert stats['notifications'] == 1
+
+def test_cooldown_is_seeded_from_stored_notifications_then_applied_in_memory(table):
+    table.store('d1', '2024-01-01T09:55:00')
+    lines = [
+        reading('2024-01-01T10:00:00'),  # within cooldown of the stored notification
+        reading('2024-01-01T10:15:00'),
+        reading('2024-01-01T10:20:00'),  # within cooldown of the 10:15 notification
+        reading('2024-01-01T10:30:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert written_timestamps(table) == ['2024-01-01T10:15:00', '2024-01-01T10:30:00']
+    assert stats['cooldown_skipped'] == 2
+    assert table.queries == 1
+
+def test_stored_notifications_inside_the_window_are_not_duplicated(table):
+    # Rows the live path wrote before the outage, spread over several query pages
+    for timestamp in ['2024-01-01T10:00:00', '2024-01-01T10:20:00', '2024-01-01T10:40:00']:
+        table.store('d1', timestamp)
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2024-01-01T10:20:00'),
+        reading('2024-01-01T10:45:00'),  # within cooldown of the stored 10:40 notification
+        reading('2024-01-01T11:00:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert written_timestamps(table) == ['2024-01-01T11:00:00']
+    assert stats['already_written'] == 2
+    assert stats['cooldown_skipped'] == 1
+    assert table.queries == 2
+
+def test_rerunning_a_replay_does_not_duplicate_rows(table):
+    lines = [reading('2024-01-01T10:00:00'), reading('2024-01-01T10:30:00', light=-1)]
+
+    first = lambda_function.replay_readings(lines, allowed_lateness=0)
+    rows = dict(table.rows)
+    second = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert set(table.rows) == set(rows) == {
+        ('d120240101T100000ambientlight', 'd1'),
+        ('d120240101T103000ambientlight', 'd1'),
+    }
+    assert first['notifications'] == 2
+    assert second['notifications'] == 0
+    assert second['already_written'] == 2
+
+def test_duplicate_readings_in_the_stream_are_written_once(table):
+    lines = [reading('2024-01-01T10:00:00'), reading('2024-01-01T10:00:00')]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert len(table.written) == 1
+    assert stats['notifications'] == 1
+    assert stats['already_written'] == 1
+
+def test_mixed_timezone_offsets_are_compared_as_utc(table):
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2024-01-01T10:20:00+00:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=300)
+
+    assert stats['errors'] == 0
+    assert stats['notifications'] == 2
+
+def test_malformed_reading_does_not_stop_the_replay(table):
+    lines = [
+        reading('2024-01-01T10:00:00'),
+        reading('2024-01-01T10:20:00', light=None),
+        reading('2024-01-01T10:25:00', device_id=['d1']),
+        'not json',
+        reading('2024-01-01T10:40:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert written_timestamps(table) == ['2024-01-01T10:00:00', '2024-01-01T10:40:00']
+    assert stats['errors'] == 3
+
+def test_missing_device_data_skips_only_that_device(table, monkeypatch):
+    lookups = []
+
+    def get_device_context(device_id):
+        lookups.append(device_id)
+        if device_id == 'unknown':
+            raise ValueError("No patient found for the given device_id")
+        return 'p1', 'Room 1', 'Pat'
+
+    monkeypatch.setattr(lambda_function, 'get_device_context', get_device_context)
+    lines = [
+        reading('2024-01-01T10:00:00', device_id='unknown'),
+        reading('2024-01-01T10:30:00', device_id='unknown'),
+        reading('2024-01-01T10:00:00'),
+    ]
+
+    stats = lambda_function.replay_readings(lines, allowed_lateness=0)
+
+    assert lookups == ['unknown', 'd1']
+    assert stats['errors'] == 2
+    assert stats['notifications'] == 1
+
+def test_transient_lookup_failure_aborts_the_replay(table, monkeypatch):
+    def get_threshold_data(patient_id):
+        raise RuntimeError('Throttled')
+
+    monkeypatch.setattr(lambda_function, 'get_threshold_data', get_threshold_data)
+
+    with pytest.raises(RuntimeError):
+        lambda_function.replay_readings([reading('2024-01-01T10:00:00')], allowed_lateness=0)
+
+def test_missing_supervisor_skips_only_the_pushes(table, monkeypatch):
+    def no_supervisor(patient_id):
+        raise ValueError(f"No supervisor found for patient_id: {patient_id}")
+
+    monkeypatch.setattr(lambda_function, 'get_supervisor_id', no_supervisor)
+    monkeypatch.setattr(lambda_function, 'invoke_fcm_lambda', lambda **kwargs: pytest.fail('push sent'))
+
+    stats = lambda_function.replay_readings([reading('2024-01-01T10:00:00')], send_fcm=True)
+
+    assert stats['notifications'] == 1
+    assert stats['errors'] == 1
+
+def test_negative_allowed_lateness_is_rejected(table):
+    with pytest.raises(ValueError):
+        lambda_function.replay_readings([reading('2024-01-01T10:00:00')], allowed_lateness=-60)
+
+def test_lambda_handler_replays_backlog_from_s3(table, monkeypatch):
+    monkeypatch.setattr(lambda_function, 's3', FakeS3([reading('2024-01-01T10:00:00'), '']))
+    monkeypatch.setattr(lambda_function, 'invoke_fcm_lambda', lambda **kwargs: pytest.fail('push sent'))
+
+    response = lambda_function.lambda_handler({'replay': {'bucket': 'backlog', 'key': 'day.ndjson'}}, None)
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['notifications'] == 1
+
+@pytest.mark.parametrize('replay', [
+    {'bucket': 'backlog', 'key': 'day.ndjson', 'send_fcm': 'false'},
+    {'bucket': 'backlog', 'key': 'day.ndjson', 'allowed_lateness': -60},
+    {'bucket': 'backlog', 'key': 'day.ndjson', 'allowed_lateness': '300'},
+    {'key': 'day.ndjson'},
+])
+def test_lambda_handler_rejects_invalid_replay_event(table, monkeypatch, replay):
+    monkeypatch.setattr(lambda_function, 's3', FakeS3([reading('2024-01-01T10:00:00')]))
+
+    response = lambda_function.lambda_handler({'replay': replay}, None)
+
+    assert response['statusCode'] == 400
+    assert table.written == []